@@ -1,37 +1,70 @@
 import json
+import logging
 import os
-from mahjong_ai import MahjongAI
+from mahjong_ai import MahjongAI, json_loads
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+log = logging.getLogger(__name__)
+
+# 超过该大小（字节）的训练数据文件以流式方式逐局解析
+STREAMING_THRESHOLD = 50_000_000
+# 读取训练数据时可能出现的解析错误
+TRAINING_DATA_ERRORS = (json.JSONDecodeError, FileNotFoundError)
+if ijson is not None:
+    TRAINING_DATA_ERRORS += (ijson.JSONError,)
 
 class MahjongWeightTrainer:
     def __init__(self, mahjong_ai):
         self.mahjong_ai = mahjong_ai
 
+    def _iter_games(self, training_data_file):
+        """
+        逐局读取训练数据，文件较大且安装了 ijson 时流式解析，避免一次性载入整个文件
+        :param training_data_file: 训练数据文件路径，顶层为每局数据组成的列表
+        """
+        with open(training_data_file, 'rb') as file:
+            if ijson is not None and os.path.getsize(training_data_file) > STREAMING_THRESHOLD:
+                yield from ijson.items(file, 'item')
+            else:
+                yield from json_loads(file.read())
+
     def train_weights(self, training_data_file):
         if not os.path.exists(training_data_file):
             print(f"训练数据文件 {training_data_file} 不存在。")
             return
 
         try:
-            with open(training_data_file, 'r', encoding='utf-8') as file:
-                training_data = json.load(file)
-
-            for game in training_data:
+            # 训练过程中只在内存中更新权重，结束后统一保存一次
+            self.mahjong_ai._batch_mode = True
+            for game in self._iter_games(training_data_file):
                 discard_pile = game.get('discard_pile', [])
                 my_discards = game.get('my_discards', [])
                 my_hand = game.get('my_hand', [])
                 new_tile = game.get('new_tile', None)
                 is_winning = game.get('is_winning', False)
 
-                self.mahjong_ai.update_state(discard_pile, my_discards, my_hand, new_tile)
+                try:
+                    self.mahjong_ai.update_state(discard_pile, my_discards, my_hand, new_tile)
+                except ValueError as e:
+                    # 含有无法识别的牌的对局直接跳过，不影响其余训练数据
+                    print(f"跳过一局训练数据: {e}")
+                    continue
                 tile_to_discard = self.mahjong_ai.choose_tile_to_discard()
                 self.mahjong_ai.last_discarded_tile = tile_to_discard  # 显式设置 last_discarded_tile
-                print(f"Before update experience: {self.mahjong_ai.tile_weights}")
+                log.debug("Before update experience: %s", self.mahjong_ai.tile_weights)
                 self.mahjong_ai.update_experience(is_winning)
-                print(f"After update experience: {self.mahjong_ai.tile_weights}")
+                log.debug("After update experience: %s", self.mahjong_ai.tile_weights)
 
+            self.mahjong_ai._save_weights(force=True)
             print("权重训练完成，已保存更新后的权重。")
-        except (json.JSONDecodeError, FileNotFoundError):
+        except TRAINING_DATA_ERRORS:
             print("读取训练数据文件时出错。")
+        finally:
+            self.mahjong_ai._batch_mode = False
 
 
 if __name__ == "__main__":
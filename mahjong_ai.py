@@ -1,225 +1,711 @@
+import atexit
 import json
+import logging
 import os
+import sys
+import threading
+import weakref
+from array import array
+from types import MappingProxyType
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+log = logging.getLogger(__name__)
+
+# 麻将牌的类型，包含万、条、筒
+TILE_TYPES = ('万', '条', '筒')
+# 所有不同的麻将牌（万、条、筒各 1~9）
+ALL_TILE_STRINGS = tuple(f"{num}{type}" for type in TILE_TYPES for num in range(1, 10))
+# 每张牌的数字和花色，避免反复解析牌的字符串
+TILE_NUM = {tile: int(tile[:-1]) for tile in ALL_TILE_STRINGS}
+TILE_SUIT = {tile: tile[-1] for tile in ALL_TILE_STRINGS}
+# 同花色中与该牌相差 -1、0、1 的牌
+TILE_NEIGHBORS = {
+    tile: tuple(f"{TILE_NUM[tile] + offset}{TILE_SUIT[tile]}" for offset in (-1, 0, 1)
+                if 1 <= TILE_NUM[tile] + offset <= 9)
+    for tile in ALL_TILE_STRINGS
+}
+# 按牌的数字索引的初始权重，下标 0 不使用
+_INITIAL_WEIGHTS = (None, 0.8, 0.9, 1.2, 1.5, 1.5, 1.5, 1.2, 0.9, 0.8)
+# 每张牌的默认权重（只读）
+DEFAULT_TILE_WEIGHTS = MappingProxyType({tile: _INITIAL_WEIGHTS[TILE_NUM[tile]] for tile in ALL_TILE_STRINGS})
+# 便于阅读的 JSON 权重文件，以及每轮保存使用的定长二进制权重文件
+WEIGHTS_JSON_PATH = "mahjong_weights.json"
+WEIGHTS_BLOB_PATH = "mahjong_weights.bin"
+# 二进制权重文件固定使用小端字节序的 double，与运行的机器无关
+WEIGHTS_BLOB_BYTEORDER = 'little'
+# 出牌选择缓存最多保存的局面数量
+CHOICE_CACHE_SIZE = 4096
+# 牌在 27 格计数列表中的下标：万 0~8，条 9~17，筒 18~26
+TILE_ID = {tile: index for index, tile in enumerate(ALL_TILE_STRINGS)}
+# 按下标排列的牌的数字
+TILE_NUM_BY_ID = tuple(TILE_NUM[tile] for tile in ALL_TILE_STRINGS)
+# 按下标排列的同花色中相差 -1、0、1 的牌的下标
+NEIGHBOR_IDS = tuple(tuple(TILE_ID[adjacent] for adjacent in TILE_NEIGHBORS[tile]) for tile in ALL_TILE_STRINGS)
+# 一种花色的 9 位掩码，第 n 位对应该花色中数字为 n + 1 的牌
+SUIT_MASK = 0x1FF
+# 按花色掩码索引的查找表：第 n 位为 1 表示该花色中有与数字 n + 1 相差 1 的牌，即这张牌能组成顺子
+SEQUENCE_MEMBERSHIP = array('H', (((mask << 1) | (mask >> 1)) & SUIT_MASK for mask in range(SUIT_MASK + 1)))
+# 按花色掩码索引的查找表：第 n 位为 1 表示该花色中有与数字 n + 1 相差 1 或 2 的牌
+WIN_ADJACENT = array('H', (((mask << 1) | (mask >> 1) | (mask << 2) | (mask >> 2)) & SUIT_MASK
+                           for mask in range(SUIT_MASK + 1)))
+
+
+def count_tiles(tiles):
+    """
+    统计每种牌的数量
+    :param tiles: 牌的列表，遇到无法识别的牌时抛出 ValueError
+    :return: 长度为 27 的列表，按 TILE_ID 下标记录每种牌的数量
+    """
+    counts = [0] * len(ALL_TILE_STRINGS)
+    for tile in tiles:
+        index = TILE_ID.get(tile)
+        if index is None:
+            raise ValueError(f"无法识别的牌: {tile}")
+        counts[index] += 1
+    return counts
+
+
+def tiles_from_counts(counts):
+    """
+    根据每种牌的数量还原出牌的列表，按 TILE_ID 顺序排列，即先按花色（万、条、筒）再按数字排序
+    :param counts: 按 TILE_ID 下标排列的数量列表
+    :return: 牌的列表
+    """
+    return [tile for tile, count in zip(ALL_TILE_STRINGS, counts) for _ in range(count)]
+
+
+def tile_mask(counts):
+    """
+    将牌的数量列表转换为位掩码
+    :param counts: 按 TILE_ID 下标排列的数量列表
+    :return: 整数，第 i 位为 1 表示 TILE_ID 为 i 的牌至少有一张
+    """
+    mask = 0
+    for index, count in enumerate(counts):
+        if count > 0:
+            mask |= 1 << index
+    return mask
+
+
+def suit_lookup(table, mask):
+    """
+    对 27 位掩码的每种花色分别查表
+    :param table: 按 9 位花色掩码索引的查找表，例如 SEQUENCE_MEMBERSHIP
+    :param mask: 第 i 位对应 TILE_ID 为 i 的牌的掩码
+    :return: 由三种花色的查表结果拼成的 27 位掩码
+    """
+    return (table[mask & SUIT_MASK]
+            | table[(mask >> 9) & SUIT_MASK] << 9
+            | table[(mask >> 18) & SUIT_MASK] << 18)
+
+
+def suit_shift_sum(values, offsets):
+    """
+    在每种花色内部按偏移量平移求和，相当于与偏移量对应的卷积核做一维卷积，超出 1~9 的部分视为 0
+    :param values: 按 TILE_ID 下标排列的列表
+    :param offsets: 偏移量，例如 (-1, 0, 1)
+    :return: 列表，第 i 项为同花色中与第 i 张牌相差各偏移量的牌对应的值之和
+    """
+    result = [0] * len(values)
+    for base in range(0, len(values), 9):
+        suit = values[base:base + 9]
+        for offset in offsets:
+            for num in range(max(0, -offset), min(9, 9 - offset)):
+                result[base + num] += suit[num + offset]
+    return result
+
+
+def score_tiles(hand_counts, discard_counts, my_discard_counts, hand_mask, discard_mask,
+                tile_weights, position_weights,
+                vf_four, vf_three, vf_pair, vf_sequence, vf_single,
+                be_eaten, be_ponged_0, be_ponged_1, be_ponged_2, be_konged, be_winning_tile, already_discarded):
+    """
+    计算全部 27 种牌的价值和风险，权重以标量或按 TILE_ID 排列的列表传入，不读取任何字典
+    :param hand_counts: 手牌数量列表
+    :param discard_counts: 公共弃牌堆数量列表
+    :param my_discard_counts: 自己弃牌数量列表
+    :param hand_mask: 手牌的位掩码，与 hand_counts 一致
+    :param discard_mask: 公共弃牌堆的位掩码，与 discard_counts 一致
+    :param tile_weights: 每张牌的权重列表
+    :param position_weights: 每张牌的位置权重列表
+    :return: (价值列表, 风险列表)，均按 TILE_ID 下标排列
+    """
+    be_ponged = (be_ponged_0, be_ponged_1, be_ponged_2)
+    # 每次决策只计算一次：能组成顺子的牌、可被吃的相邻弃牌数量、附近有弃牌的牌
+    discarded = [1 if count > 0 else 0 for count in discard_counts]
+    sequence_mask = suit_lookup(SEQUENCE_MEMBERSHIP, hand_mask)
+    eaten_neighbors = suit_shift_sum(discarded, (-1, 0, 1))
+    winning_mask = suit_lookup(WIN_ADJACENT, discard_mask)
+    values = []
+    risks = []
+    for index in range(len(ALL_TILE_STRINGS)):
+        count = hand_counts[index]
+        discard_count = discard_counts[index]
+
+        # 牌的价值：根据牌的数量或能否组成顺子选择系数，乘以牌的权重
+        combined_weight = tile_weights[index]
+        if count == 4:
+            value = vf_four * combined_weight
+        elif count == 3:
+            value = vf_three * combined_weight
+        elif count == 2:
+            value = vf_pair * combined_weight
+        elif sequence_mask >> index & 1:
+            value = vf_sequence * combined_weight
+        else:
+            value = vf_single * combined_weight
+        values.append(value + position_weights[index])
+
+        # 牌的风险：被吃、被碰、被杠、放炮以及已经打出过
+        risk = be_eaten * eaten_neighbors[index]
+        if discard_count < 3:
+            risk += be_ponged[discard_count]
+        if discard_count == 0:
+            risk += be_konged
+        if discard_count >= 2 or winning_mask >> index & 1:
+            risk += be_winning_tile
+        if my_discard_counts[index] > 0:
+            risk += already_discarded
+        risks.append(max(risk, 0))
+    return values, risks
+
+
+def json_loads(data):
+    """
+    解析 JSON 字节串，安装了 orjson 时优先使用 orjson
+    :param data: JSON 字节串
+    :return: 解析后的对象
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(obj):
+    """
+    将对象序列化为 JSON 字节串，安装了 orjson 时优先使用 orjson
+    :param obj: 要序列化的对象
+    :return: UTF-8 编码的 JSON 字节串
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8')
+
+
+def _atomic_write(file_path, data):
+    """
+    先写入临时文件再替换目标文件，避免写到一半中断时损坏文件
+    :param file_path: 目标文件路径
+    :param data: 要写入的字节串
+    """
+    temp_path = file_path + ".tmp"
+    with open(temp_path, 'wb') as file:
+        file.write(data)
+    os.replace(temp_path, file_path)
+
+
+class _BackgroundWriter:
+    """
+    所有 MahjongAI 实例共用的后台写入线程，第一次写入时才启动，
+    同一路径只保留最新一份尚未写入的数据
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self._writing = False
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def submit(self, file_path, data):
+        """
+        提交一份待写入的数据，该路径上一份数据还没写入时直接被替换
+        :param file_path: 目标文件路径
+        :param data: 要写入的字节串
+        """
+        with self._condition:
+            self._pending[file_path] = data
+            if self._thread is None:
+                thread = threading.Thread(target=self._run, daemon=True)
+                # 启动失败时不记录线程，下一次提交时重新启动
+                thread.start()
+                self._thread = thread
+            self._condition.notify_all()
+
+    def join(self):
+        """
+        等待全部已提交的数据写入完成，后台线程没有启动时直接在当前线程写入
+        """
+        with self._condition:
+            if self._thread is not None:
+                while self._pending or self._writing:
+                    self._condition.wait()
+                return
+            pending, self._pending = self._pending, {}
+        for file_path, data in pending.items():
+            try:
+                _atomic_write(file_path, data)
+            except Exception:
+                print("保存权重文件时出错。")
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                file_path, data = self._pending.popitem()
+                self._writing = True
+            try:
+                _atomic_write(file_path, data)
+            except Exception:
+                print("保存权重文件时出错。")
+            finally:
+                with self._condition:
+                    self._writing = False
+                    self._condition.notify_all()
+
+
+# 权重文件的后台写入线程
+_writer = _BackgroundWriter()
+# 全部 MahjongAI 实例的弱引用，以及最近一次保存权重的实例
+_instances = weakref.WeakSet()
+_last_saved = None
+
+
+@atexit.register
+def _flush_weights():
+    """
+    程序退出时调用：等待后台线程写入完成，保存各实例尚未保存的修改，
+    再由最近一次保存权重的实例导出 JSON 权重文件
+    """
+    global _last_saved
+    _writer.join()
+    # 解释器退出时不能再启动线程，尚未保存的修改直接在当前线程写入
+    for ai in list(_instances):
+        if ai._dirty:
+            try:
+                _atomic_write(WEIGHTS_BLOB_PATH, ai._pack_weights())
+            except Exception:
+                print("保存权重文件时出错。")
+                continue
+            ai._dirty = False
+            ai._export_pending = True
+            _last_saved = weakref.ref(ai)
+    ai = _last_saved() if _last_saved is not None else None
+    if ai is not None and ai._export_pending:
+        ai.export_weights()
+
+
+class WeightVector:
+    """
+    按固定顺序平铺存放的一组权重，可以按名称读写，也可以整体缩放并截断
+    """
+
+    def __init__(self, names, values):
+        """
+        :param names: 权重名称，决定权重在 values 中的顺序
+        :param values: 与 names 一一对应的初始权重
+        """
+        self.names = tuple(names)
+        self.index = {name: position for position, name in enumerate(self.names)}
+        self.values = list(values)
+
+    def __getitem__(self, name):
+        return self.values[self.index[name]]
+
+    def __setitem__(self, name, value):
+        self.values[self.index[name]] = value
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def get(self, name, default=None):
+        position = self.index.get(name)
+        return default if position is None else self.values[position]
+
+    def scale(self, factor, low, high, positions=None):
+        """
+        将权重乘以同一个因子，并截断到 [low, high] 范围内
+        :param positions: 只缩放这些下标的权重，为 None 时缩放全部权重
+        :return: 是否有权重发生变化，权重都已截断在边界上时返回 False
+        """
+        values = self.values
+        if positions is None:
+            scaled = [max(low, min(value * factor, high)) for value in values]
+            changed = scaled != values
+            values[:] = scaled
+            return changed
+        changed = False
+        for position in positions:
+            value = max(low, min(values[position] * factor, high))
+            if value != values[position]:
+                values[position] = value
+                changed = True
+        return changed
+
+    def update(self, data):
+        """
+        用字典中的权重覆盖同名权重，未知的名称会被忽略
+        :param data: 名称到权重的字典
+        """
+        for name, value in data.items():
+            if name in self.index:
+                self[name] = value
+
+    def load(self, data):
+        """
+        用权重文件中的数据整体覆盖当前权重
+        :param data: 名称到权重的字典，或按 names 顺序排列的权重列表
+        """
+        if isinstance(data, dict):
+            self.update(data)
+            return
+        if len(data) != len(self.values):
+            raise ValueError("权重数量不正确")
+        self.values[:] = data
+
+    def to_dict(self):
+        """
+        转换为名称到权重的字典，用于显示
+        """
+        return dict(zip(self.names, self.values))
+
+
+class RiskFactors(WeightVector):
+    """
+    风险因素权重，被碰风险按弃牌数量 0、1、2 展开为三项，保存和显示时仍嵌套为字典
+    """
+    NAMES = ("be_eaten", "be_ponged_0", "be_ponged_1", "be_ponged_2",
+             "be_konged", "be_winning_tile", "already_discarded")
+
+    def __init__(self, values):
+        super().__init__(self.NAMES, values)
+
+    def update(self, data):
+        data = dict(data)
+        # JSON 的键都是字符串，被碰风险的键可能是 "0"、"1"、"2"
+        for count, value in data.pop("be_ponged", {}).items():
+            data[f"be_ponged_{int(count)}"] = value
+        super().update(data)
+
+    def to_dict(self):
+        return {
+            "be_eaten": self["be_eaten"],
+            "be_ponged": {count: self[f"be_ponged_{count}"] for count in range(3)},
+            "be_konged": self["be_konged"],
+            "be_winning_tile": self["be_winning_tile"],
+            "already_discarded": self["already_discarded"]
+        }
+
+
+# 价值因素权重的名称，顺序与 score_tiles 的参数顺序一致
+VALUE_FACTOR_NAMES = ("four_of_a_kind", "three_of_a_kind", "pair", "sequence", "single")
+
 
 class MahjongAI:
     def __init__(self):
         # 定义麻将牌的类型，包含万、条、筒
-        self.tile_types = ['万', '条', '筒']
-        # 生成所有的麻将牌，每种牌有 4 张
-        self.all_tiles = [f"{num}{type}" for type in self.tile_types for num in range(1, 10)] * 4
-        # 公共的弃牌堆
-        self.discard_pile = []
-        # 自己的弃牌列表
-        self.my_discards = []
-        # 自己手中的牌
-        self.my_hand = []
+        self.tile_types = list(TILE_TYPES)
         # 新摸到的牌
         self.new_tile = None
         # 上一次打出的牌
         self.last_discarded_tile = None
+        # 按 TILE_ID 下标统计的手牌、公共弃牌堆和自己弃牌的数量，游戏状态只保存这三个计数列表
+        self.hand_counts = [0] * len(ALL_TILE_STRINGS)
+        self.discard_counts = [0] * len(ALL_TILE_STRINGS)
+        self.my_discard_counts = [0] * len(ALL_TILE_STRINGS)
+        # 手牌和公共弃牌堆的位掩码，用于快速判断相邻牌是否存在
+        self.hand_mask = 0
+        self.discard_mask = 0
 
         # 初始化每张牌的权重
-        self.tile_weights = {
-            f"{num}{type}": self._get_initial_weight(num)
-            for type in self.tile_types for num in range(1, 10)
-        }
-        # 不同位置牌的权重
-        self.position_weights = {1: -2, 2: -1, 3: 1, 4: 1, 5: 1, 6: 1, 7: 1, 8: -1, 9: -2}
+        self.tile_weights = WeightVector(ALL_TILE_STRINGS, DEFAULT_TILE_WEIGHTS.values())
+        # 不同位置牌的权重，按牌的数字索引，下标 0 不使用
+        self.position_weights = [0, -2, -1, 1, 1, 1, 1, 1, -1, -2]
         # 各种风险因素的权重
-        self.risk_factors = {
-            "be_eaten": 2,
-            "be_ponged": {0: 8, 1: 4, 2: 0},
-            "be_konged": 4,
-            "be_winning_tile": 10,
-            "already_discarded": -5
-        }
-        # 各种牌型的价值因素权重
-        self.value_factors = {
-            "four_of_a_kind": 20,
-            "three_of_a_kind": 15,
-            "pair": 10,
-            "sequence": 5,
-            "single": 1
-        }
+        # 顺序为：被吃、被碰（弃牌数量 0、1、2）、被杠、放炮、已经打出过
+        self.risk_factors = RiskFactors((2, 8, 4, 0, 4, 10, -5))
+        # 各种牌型的价值因素权重：四张、三张、对子、顺子、单牌
+        self.value_factors = WeightVector(VALUE_FACTOR_NAMES, (20, 15, 10, 5, 1))
+        # 权重是否有尚未保存到文件的修改
+        self._dirty = False
+        # 批量模式下只标记修改，不写文件，由调用方在结束时统一保存
+        self._batch_mode = False
+        # 二进制权重文件是否有尚未导出到 JSON 权重文件的修改
+        self._export_pending = False
+        # 局面到 (所选牌的下标, 所选牌的风险) 的缓存，权重变化时清空
+        self._choice_cache = {}
         # 从文件中加载权重
         self._load_weights()
+        # 退出时由 _flush_weights 保存尚未写入文件的权重，弱引用不会阻止实例被回收
+        _instances.add(self)
 
-    def update_experience(self, is_winning):
+    def _load_weights(self):
         """
-        根据游戏是否获胜更新权重，以积累经验
-        :param is_winning: 布尔值，表示游戏是否获胜
+        从文件中加载权重。JSON 权重文件是权重的来源，删除它即可恢复默认权重；
+        二进制权重文件不比 JSON 文件旧时优先加载二进制文件，
+        如果文件不存在或解析出错则使用默认权重
         """
-        if not self.last_discarded_tile:
+        if not os.path.exists(WEIGHTS_JSON_PATH):
             return
-        tile = self.last_discarded_tile
-        num = int(tile[:-1])
-        # 根据是否获胜确定调整因子
-        factor = 1.1 if is_winning else 0.9
+        if os.path.exists(WEIGHTS_BLOB_PATH) and \
+                os.path.getmtime(WEIGHTS_BLOB_PATH) >= os.path.getmtime(WEIGHTS_JSON_PATH):
+            try:
+                with open(WEIGHTS_BLOB_PATH, 'rb') as file:
+                    self._unpack_weights(file.read())
+                return
+            except (OSError, ValueError):
+                print("加载二进制权重文件时出错，将尝试加载 JSON 权重文件。")
+        # 某组权重出错时恢复全部默认权重，不保留已经加载的其他几组
+        weight_lists = (self.tile_weights.values, self.position_weights,
+                        self.risk_factors.values, self.value_factors.values)
+        defaults = [list(values) for values in weight_lists]
+        try:
+            with open(WEIGHTS_JSON_PATH, 'rb') as file:
+                data = json_loads(file.read())
+            if 'position_weights' in data:
+                self._load_position_weights(data['position_weights'])
+            for name in ('tile_weights', 'risk_factors', 'value_factors'):
+                if name in data:
+                    getattr(self, name).load(data[name])
+        except (ValueError, TypeError, IndexError, AttributeError, FileNotFoundError):
+            # 文件能解析为 JSON 但结构不对时也会抛出 TypeError、IndexError 或 AttributeError
+            for values, default in zip(weight_lists, defaults):
+                values[:] = default
+            print("加载权重文件时出错，将使用默认权重。")
 
-        print(
-            f"Before update: tile_weights={self.tile_weights}, position_weights={self.position_weights}, risk_factors={self.risk_factors}, value_factors={self.value_factors}")
+    def _load_position_weights(self, data):
+        """
+        从权重文件中恢复位置权重
+        :param data: 数字到权重的字典，或数字 1~9 的位置权重列表
+        """
+        if isinstance(data, dict):
+            # JSON 的键都是字符串，需要还原为整数下标，1~9 以外的数字会被忽略
+            for num, weight in data.items():
+                num = int(num)
+                if 1 <= num <= 9:
+                    self.position_weights[num] = weight
+            return
+        if len(data) != 9:
+            raise ValueError("位置权重数量不正确")
+        self.position_weights[1:] = data
 
-        # 更新价值因素权重
-        self._update_value_factors(tile, factor)
-        # 更新牌的权重
-        self._update_tile_weights(tile, num, factor)
-        # 更新位置权重
-        self._update_position_weights(num, factor)
-        # 更新风险因素权重
-        self._update_risk_factors(factor)
+    def _pack_weights(self):
+        """
+        按固定顺序将全部权重打包为二进制数据：牌的权重、数字 1~9 的位置权重、风险因素、价值因素
+        :return: 字节串
+        """
+        values = array('d', self.tile_weights.values)
+        values.extend(self.position_weights[1:])
+        values.extend(self.risk_factors.values)
+        values.extend(self.value_factors.values)
+        if sys.byteorder != WEIGHTS_BLOB_BYTEORDER:
+            values.byteswap()
+        return values.tobytes()
 
-        # 保存更新后的权重到文件
-        self._save_weights()
-        print(
-            f"After update: tile_weights={self.tile_weights}, position_weights={self.position_weights}, risk_factors={self.risk_factors}, value_factors={self.value_factors}")
+    def _unpack_weights(self, data):
+        """
+        从 _pack_weights 生成的二进制数据中恢复全部权重
+        :param data: 字节串
+        """
+        values = array('d')
+        values.frombytes(data)
+        if sys.byteorder != WEIGHTS_BLOB_BYTEORDER:
+            values.byteswap()
+        tile_count = len(self.tile_weights.values)
+        risk_start = tile_count + 9
+        value_start = risk_start + len(self.risk_factors.values)
+        if len(values) != value_start + len(self.value_factors.values):
+            raise ValueError("权重文件长度不正确")
+        self.tile_weights.load(values[:tile_count])
+        self._load_position_weights(values[tile_count:risk_start])
+        self.risk_factors.load(values[risk_start:value_start])
+        self.value_factors.load(values[value_start:])
 
-    def _get_initial_weight(self, num):
+    def _save_weights(self, force=False):
         """
-        根据牌的数字获取初始权重
-        :param num: 牌的数字
-        :return: 初始权重
+        将当前的权重保存到二进制权重文件中
+        :param force: 为 True 时即使处于批量模式也立即保存
         """
-        if num in [1, 9]:
-            return 0.8
-        elif num in [2, 8]:
-            return 0.9
-        elif num in [3, 7]:
-            return 1.2
-        return 1.5
+        if self._batch_mode and not force:
+            self._dirty = True
+            return
+        global _last_saved
+        self._dirty = False
+        self._export_pending = True
+        _last_saved = weakref.ref(self)
+        _writer.submit(WEIGHTS_BLOB_PATH, self._pack_weights())
 
-    def _load_weights(self):
+    def export_weights(self):
         """
-        从文件中加载权重，如果文件不存在或解析出错则使用默认权重
+        将当前的权重导出为便于阅读的 JSON 权重文件
         """
-        file_path = "mahjong_weights.json"
-        if os.path.exists(file_path):
-            try:
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    data = json.load(file)
-                    self.tile_weights = data.get('tile_weights', self.tile_weights)
-                    self.position_weights = data.get('position_weights', self.position_weights)
-                    self.risk_factors = data.get('risk_factors', self.risk_factors)
-                    self.value_factors = data.get('value_factors', self.value_factors)
-            except (json.JSONDecodeError, FileNotFoundError):
-                print("加载权重文件时出错，将使用默认权重。")
-
-    def _save_weights(self):
-        """
-        将当前的权重保存到文件中
-        """
-        file_path = "mahjong_weights.json"
-        data = {
-            "tile_weights": self.tile_weights,
-            "position_weights": self.position_weights,
-            "risk_factors": self.risk_factors,
-            "value_factors": self.value_factors
-        }
         try:
-            with open(file_path, 'w', encoding='utf-8') as file:
-                json.dump(data, file, ensure_ascii=False, indent=4)
+            _atomic_write(WEIGHTS_JSON_PATH, json_dumps(self._snapshot()))
+            self._export_pending = False
         except Exception:
             print("保存权重文件时出错。")
 
+    def _snapshot(self):
+        """
+        获取需要导出到 JSON 权重文件中的全部权重，每组权重都以名称为键，便于阅读：
+        牌的权重以牌为键，位置权重以数字 1~9 为键，风险因素和价值因素以因素名称为键
+        """
+        return {
+            "tile_weights": self.tile_weights.to_dict(),
+            "position_weights": dict(zip(range(1, 10), self.position_weights[1:])),
+            "risk_factors": self.risk_factors.to_dict(),
+            "value_factors": self.value_factors.to_dict()
+        }
+
     def update_state(self, discard_pile, my_discards, my_hand, new_tile):
         """
         更新游戏状态
         """
-        self.discard_pile = discard_pile
-        self.my_discards = my_discards
-        self.my_hand = my_hand
-        self.new_tile = new_tile
+        # 传入的列表只在这里统计一次，不保存也不修改，之后的评估和出牌都只读写计数列表
+        # 全部统计完成后再更新状态，含有无法识别的牌时抛出 ValueError 并保持原有状态
+        hand_counts = count_tiles(my_hand)
         if new_tile:
-            self.my_hand.append(new_tile)
+            if new_tile not in TILE_ID:
+                raise ValueError(f"无法识别的牌: {new_tile}")
+            hand_counts[TILE_ID[new_tile]] += 1
+        discard_counts = count_tiles(discard_pile)
+        my_discard_counts = count_tiles(my_discards)
+        self.new_tile = new_tile
+        self.hand_counts = hand_counts
+        self.discard_counts = discard_counts
+        self.my_discard_counts = my_discard_counts
+        self.hand_mask = tile_mask(self.hand_counts)
+        self.discard_mask = tile_mask(self.discard_counts)
 
-    def evaluate_tile_value(self, tile):
-        """
-        评估一张牌的价值
-        """
-        count = self.my_hand.count(tile)#牌的数量
-        combined_weight = self.tile_weights[tile] + self.get_remaining_weight(tile)#牌的权重
-        value = self._get_value_based_on_count(count, combined_weight, tile)#牌的价值
-        return value + self.get_positional_weight(tile)#牌的位置权重
+    @property
+    def my_hand(self):
+        """自己手中的牌，由手牌计数还原，按 TILE_ID 顺序排列"""
+        return tiles_from_counts(self.hand_counts)
+
+    @property
+    def discard_pile(self):
+        """公共的弃牌堆，由弃牌计数还原，按 TILE_ID 顺序排列"""
+        return tiles_from_counts(self.discard_counts)
 
-    def _get_value_based_on_count(self, count, combined_weight, tile=None):
+    @property
+    def my_discards(self):
+        """自己的弃牌列表，由自己弃牌的计数还原，按 TILE_ID 顺序排列"""
+        return tiles_from_counts(self.my_discard_counts)
+
+    def evaluate_tile_value(self, tile):
         """
-        根据牌的数量和组合权重计算牌的价值
+        评估一张牌的价值，只计算这一张牌，与 score_tiles 中的计算一致
         """
+        index = TILE_ID[tile]
+        count = self.hand_counts[index]
         if count == 4:
-            return self.value_factors["four_of_a_kind"] * combined_weight
+            factor = self.value_factors["four_of_a_kind"]
         elif count == 3:
-            return self.value_factors["three_of_a_kind"] * combined_weight
+            factor = self.value_factors["three_of_a_kind"]
         elif count == 2:
-            return self.value_factors["pair"] * combined_weight
-        elif tile and self.is_part_of_sequence(tile):
-            return self.value_factors["sequence"] * combined_weight
-        return self.value_factors["single"] * combined_weight
+            factor = self.value_factors["pair"]
+        elif self.is_part_of_sequence(tile):
+            factor = self.value_factors["sequence"]
+        else:
+            factor = self.value_factors["single"]
+        return factor * self.tile_weights.values[index] + self.get_positional_weight(tile)
 
     def get_positional_weight(self, tile):
         """
         获取牌的位置权重
         """
-        num = int(tile[:-1])
-        return self.position_weights.get(num, 0)
-
-    def get_remaining_weight(self, tile):
-        """
-        根据公共弃牌堆中牌的数量获取剩余权重
-        """
-        discard_count = self.discard_pile.count(tile)
-        return {-5: 0, -2: 1}.get(discard_count, 0)
+        return self.position_weights[TILE_NUM[tile]]
 
     def is_part_of_sequence(self, tile):
         """
         判断一张牌是否是顺子的一部分
         """
-        num, type = int(tile[:-1]), tile[-1]
-        return any(f"{num + offset}{type}" in self.my_hand and f"{num + offset}{type}" != tile for offset in [-1, 0, 1])
+        index = TILE_ID[tile]
+        base = index - index % 9
+        return bool(SEQUENCE_MEMBERSHIP[(self.hand_mask >> base) & SUIT_MASK] >> (index - base) & 1)
 
     def evaluate_tile_risk(self, tile):
-        num, type = int(tile[:-1]), tile[-1]
-        risk = 0
-        # 计算被吃的风险
-        risk += sum(self.risk_factors["be_eaten"] for offset in [-1, 0, 1]
-                    if f"{num + offset}{type}" in self.discard_pile)
-        # 计算被碰的风险
-        risk += self.risk_factors["be_ponged"].get(self.discard_pile.count(tile), 0)
-        # 计算被杠的风险
-        risk += self.risk_factors["be_konged"] if self.discard_pile.count(tile) == 0 else 0
-        # 计算是胡牌的风险
-        risk += self.risk_factors["be_winning_tile"] if self.is_potential_win_tile(tile) else 0
-        # 计算已经打出过的风险
-        risk += self.risk_factors["already_discarded"] if tile in self.my_discards else 0
-
-        # 调整风险因素权重
-        self._adjust_risk_factors(risk)
+        """
+        评估一张牌的风险，只计算这一张牌，与 score_tiles 中的计算一致
+        """
+        index = TILE_ID[tile]
+        discard_count = self.discard_counts[index]
+        risk_factors = self.risk_factors
+        eaten_neighbors = sum(1 for adjacent in NEIGHBOR_IDS[index] if self.discard_counts[adjacent] > 0)
+        risk = risk_factors["be_eaten"] * eaten_neighbors
+        if discard_count < 3:
+            risk += risk_factors[f"be_ponged_{discard_count}"]
+        if discard_count == 0:
+            risk += risk_factors["be_konged"]
+        if self.is_potential_win_tile(tile):
+            risk += risk_factors["be_winning_tile"]
+        if self.my_discard_counts[index] > 0:
+            risk += risk_factors["already_discarded"]
         return max(risk, 0)
 
+    def _score_tiles(self):
+        """
+        一次性计算全部 27 种牌的价值和风险
+        :return: (价值列表, 风险列表)，均按 TILE_ID 下标排列
+        """
+        # 位置权重按数字索引，按下标展开成 27 项
+        position_weights = self.position_weights
+        return score_tiles(
+            self.hand_counts, self.discard_counts, self.my_discard_counts, self.hand_mask, self.discard_mask,
+            self.tile_weights.values, [position_weights[num] for num in TILE_NUM_BY_ID],
+            *self.value_factors.values, *self.risk_factors.values
+        )
+
     def _adjust_risk_factors(self, risk):
         #根据风险值调整风险因素的权重
 
         factor = 1.1 if risk > 10 else 0.9 if risk < 5 else 1
-        for key in self.risk_factors:
-            if isinstance(self.risk_factors[key], dict):
-                for sub_key in self.risk_factors[key]:
-                    self.risk_factors[key][sub_key] = max(-10, min(self.risk_factors[key][sub_key] * factor, 20))
-            else:
-                self.risk_factors[key] = max(-10, min(self.risk_factors[key] * factor, 20))
-        # 保存更新后的权重到文件
-        self._save_weights()
+        # 风险适中时权重不变，无需遍历也无需保存
+        if factor == 1:
+            return
+        # 权重都已截断在边界上时没有变化，缓存的出牌选择仍然有效
+        if not self.risk_factors.scale(factor, -10, 20):
+            return
+        self._choice_cache.clear()
+        # 只标记为待保存，由 update_experience 或程序退出时统一写入文件
+        self._dirty = True
 
     def is_potential_win_tile(self, tile):
         #判断一张牌是否是潜在的胡牌
 
-        num, type = int(tile[:-1]), tile[-1]
-        return self.discard_pile.count(tile) >= 2 or any(
-            f"{num + offset}{type}" in self.discard_pile for offset in [-2, -1, 1, 2])
+        index = TILE_ID[tile]
+        base = index - index % 9
+        return (self.discard_counts[index] >= 2
+                or bool(WIN_ADJACENT[(self.discard_mask >> base) & SUIT_MASK] >> (index - base) & 1))
 
     def choose_tile_to_discard(self):
         """
-        选择要打出的牌，选择价值减去风险最小的牌
-        """
-        scores = [(tile, self.evaluate_tile_value(tile) - self.evaluate_tile_risk(tile)) for tile in self.my_hand]
-        return min(scores, key=lambda x: x[1])[0]
+        选择要打出的牌，选择价值减去风险最小的牌。
+        有多张牌并列最小时选择 TILE_ID 最小的牌，即先按花色（万、条、筒）再按数字，与手牌的输入顺序无关
+        """
+        key = (tuple(self.hand_counts), tuple(self.discard_counts), tuple(self.my_discard_counts))
+        choice = self._choice_cache.get(key)
+        if choice is None:
+            # 所有牌都基于同一份权重快照评估，评估过程中不修改权重
+            values, risks = self._score_tiles()
+            # 只在手中有的牌里选择，相同的牌只比较一次；按 TILE_ID 顺序遍历，min 在并列时保留第一张
+            in_hand = [index for index, count in enumerate(self.hand_counts) if count > 0]
+            best = min(in_hand, key=lambda index: values[index] - risks[index])
+            choice = (best, risks[best])
+            if len(self._choice_cache) >= CHOICE_CACHE_SIZE:
+                self._choice_cache.clear()
+            self._choice_cache[key] = choice
+        best, risk = choice
+        # 选定后根据所选牌的风险调整一次风险因素权重
+        self._adjust_risk_factors(risk)
+        return ALL_TILE_STRINGS[best]
 
     def play(self, discard_pile, my_discards, my_hand, new_tile):
         """
@@ -232,20 +718,26 @@ class MahjongAI:
         """
         self.update_state(discard_pile, my_discards, my_hand, new_tile)
         tile_to_discard = self.choose_tile_to_discard()
-        self.my_hand.remove(tile_to_discard)
-        self.my_discards.append(tile_to_discard)
+        index = TILE_ID[tile_to_discard]
+        self.hand_counts[index] -= 1
+        if self.hand_counts[index] == 0:
+            self.hand_mask &= ~(1 << index)
+        self.my_discard_counts[index] += 1
         self.last_discarded_tile = tile_to_discard
         return tile_to_discard
 
     def update_experience(self, is_winning):
         """
         根据游戏是否获胜更新权重，以积累经验
+        :param is_winning: 布尔值，表示游戏是否获胜
         """
         if not self.last_discarded_tile:
             return
         tile = self.last_discarded_tile
-        num = int(tile[:-1])
+        num = TILE_NUM[tile]
         factor = 1.1 if is_winning else 0.9
+        log.debug("Before update: tile_weights=%s, position_weights=%s, risk_factors=%s, value_factors=%s",
+                  self.tile_weights, self.position_weights, self.risk_factors, self.value_factors)
 
         # 更新价值因素权重
         self._update_value_factors(tile, factor)
@@ -255,8 +747,12 @@ class MahjongAI:
         self._update_position_weights(num, factor)
         # 更新风险因素权重
         self._update_risk_factors(factor)
+        # 权重已变化，之前缓存的出牌选择不再有效
+        self._choice_cache.clear()
         # 保存更新后的权重到文件
         self._save_weights()
+        log.debug("After update: tile_weights=%s, position_weights=%s, risk_factors=%s, value_factors=%s",
+                  self.tile_weights, self.position_weights, self.risk_factors, self.value_factors)
 
     def _update_value_factors(self, tile, factor):
         """
@@ -264,11 +760,11 @@ class MahjongAI:
         :param tile: 上一次打出的牌
         :param factor: 调整因子
         """
-        count = self.my_hand.count(tile) + 1
-        for key, condition in [("four_of_a_kind", count >= 4), ("three_of_a_kind", count >= 3),
-                               ("pair", count >= 2), ("sequence", self.is_part_of_sequence(tile))]:
-            if condition:
-                self.value_factors[key] = max(0.5, min(self.value_factors[key] * factor, 3.0))
+        count = self.hand_counts[TILE_ID[tile]] + 1
+        # 下标与 VALUE_FACTOR_NAMES 对应：四张、三张、对子、顺子
+        positions = [position for position, condition in enumerate(
+            (count >= 4, count >= 3, count >= 2, self.is_part_of_sequence(tile))) if condition]
+        self.value_factors.scale(factor, 0.5, 3.0, positions)
 
     def _update_tile_weights(self, tile, num, factor):
         """
@@ -277,15 +773,10 @@ class MahjongAI:
         :param num: 牌的数字
         :param factor: 调整因子
         """
-        self.tile_weights[tile] = max(0.5, min(self.tile_weights[tile] * (1.2 if factor > 1 else 0.8), 2.0))
-        for offset in [-1, 0, 1]:
-            adjacent_num = num + offset
-            if 1 <= adjacent_num <= 9:
-                adjacent_tile = f"{adjacent_num}{tile[-1]}"
-                if adjacent_tile in self.tile_weights:
-                    self.tile_weights[adjacent_tile] = max(0.5,
-                                                           min(self.tile_weights[adjacent_tile] * (
-                                                               1.1 if factor > 1 else 0.9), 2.0))
+        index = TILE_ID[tile]
+        self.tile_weights.scale(1.2 if factor > 1 else 0.8, 0.5, 2.0, (index,))
+        # 同花色中相差 -1、0、1 的牌（包括这张牌本身）再调整一次
+        self.tile_weights.scale(1.1 if factor > 1 else 0.9, 0.5, 2.0, NEIGHBOR_IDS[index])
 
     def _update_position_weights(self, num, factor):
         """
@@ -293,17 +784,11 @@ class MahjongAI:
         :param num: 牌的数字
         :param factor: 调整因子
         """
-        self.position_weights[num] = max(-3, min(self.position_weights.get(num, 0) * factor, 3))
+        self.position_weights[num] = max(-3, min(self.position_weights[num] * factor, 3))
 
     def _update_risk_factors(self, factor):
         """
         根据游戏结果更新风险因素的权重
         :param factor: 调整因子
         """
-        for key in self.risk_factors:
-            if isinstance(self.risk_factors[key], dict):
-                for sub_key in self.risk_factors[key]:
-                    self.risk_factors[key][sub_key] = max(-10, min(
-                        self.risk_factors[key][sub_key] * (0.9 if factor > 1 else 1.1), 20))
-            else:
-                self.risk_factors[key] = max(-10, min(self.risk_factors[key] * (0.9 if factor > 1 else 1.1), 20))
\ No newline at end of file
+        self.risk_factors.scale(0.9 if factor > 1 else 1.1, -10, 20)
\ No newline at end of file
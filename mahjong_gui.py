@@ -1,5 +1,5 @@
 import tkinter as tk
-from mahjong_ai import MahjongAI
+from mahjong_ai import MahjongAI, TILE_NEIGHBORS, tiles_from_counts
 
 
 class MahjongApp:
@@ -7,6 +7,8 @@ class MahjongApp:
         self.root = root
         self.root.title("麻将 AI 策略系统")
         self.ai = MahjongAI()
+        # 权重显示区域当前的内容
+        self._last_weights_text = None
         self.create_widgets()
 
     def create_widgets(self):
@@ -53,30 +55,32 @@ class MahjongApp:
         self.weights_text.grid(row=8, column=0, columnspan=3, padx=10, pady=5)
         self.update_weights_display()
 
-    def sort_hand(self, hand):
-        """对手牌进行排序"""
-        tile_order = {'万': 0, '条': 1, '筒': 2}
-        return sorted(hand, key=lambda tile: (tile_order[tile[-1]], int(tile[:-1])))
+    def read_tiles(self, entry):
+        """读取输入框中逗号分隔的牌"""
+        return [tile.strip() for tile in entry.get().split(",") if tile.strip()]
+
+    def set_entry_text(self, entry, text):
+        """更新输入框内容，内容没有变化时不重新写入"""
+        if entry.get() != text:
+            entry.delete(0, tk.END)
+            entry.insert(0, text)
 
     def run_ai(self):
         """运行 AI 并显示结果"""
         try:
-            hand = [tile.strip() for tile in self.hand_entry.get().split(",") if tile.strip()]
+            # 手牌只在 update_state 中统计一次数量
+            hand = self.read_tiles(self.hand_entry)
             new_tile = self.new_tile_entry.get().strip()
-            discard_pile = [tile.strip() for tile in self.discard_pile_entry.get().split(",") if tile.strip()]
-            my_discards = [tile.strip() for tile in self.my_discards_entry.get().split(",") if tile.strip()]
+            discard_pile = self.read_tiles(self.discard_pile_entry)
+            my_discards = self.read_tiles(self.my_discards_entry)
 
             tile_to_discard = self.ai.play(discard_pile, my_discards, hand, new_tile)
             self.result_label.config(text=tile_to_discard)
 
-            remaining_hand = self.ai.my_hand[:]
-            sorted_hand = self.sort_hand(remaining_hand)
-            self.hand_entry.delete(0, tk.END)
-            self.hand_entry.insert(0, ", ".join(sorted_hand))
-
-            updated_discards = self.ai.my_discards[:]
-            self.my_discards_entry.delete(0, tk.END)
-            self.my_discards_entry.insert(0, ", ".join(updated_discards))
+            # 按 TILE_ID 顺序还原的手牌已经排好序
+            self.set_entry_text(self.hand_entry, ", ".join(tiles_from_counts(self.ai.hand_counts)))
+            # 自己的弃牌按打出的顺序显示，AI 只保存计数
+            self.set_entry_text(self.my_discards_entry, ", ".join(my_discards + [tile_to_discard]))
 
             self.update_weights_display()
         except Exception as e:
@@ -101,24 +105,26 @@ class MahjongApp:
             self.result_label.config(text=f"错误: {str(e)}")
 
     def update_weights_display(self):
-        """更新权重显示区域"""
-        weights_text = "当前权重设置:\n"
-        weights_text += f"位置权重: {self.ai.position_weights}\n"
-        weights_text += f"价值评估系数: {self.ai.value_factors}\n"
-        weights_text += f"风险评估系数: {self.ai.risk_factors}\n"
+        """更新权重显示区域，内容没有变化时不重新写入"""
+        parts = [
+            "当前权重设置:\n",
+            f"位置权重: {dict(zip(range(1, 10), self.ai.position_weights[1:]))}\n",
+            f"价值评估系数: {self.ai.value_factors}\n",
+            f"风险评估系数: {self.ai.risk_factors}\n",
+        ]
 
         if self.ai.last_discarded_tile:
             tile = self.ai.last_discarded_tile
-            weights_text += f"\n最后打出的牌 '{tile}' 的权重: {self.ai.tile_weights.get(tile, 1.0):.2f}\n"
-            weights_text += f"相邻牌权重: "
-            num = int(tile[:-1])
-            for offset in [-1, 0, 1]:
-                adjacent_num = num + offset
-                if 1 <= adjacent_num <= 9:
-                    adjacent_tile = f"{adjacent_num}{tile[-1]}"
-                    weights_text += f"{adjacent_tile}:{self.ai.tile_weights.get(adjacent_tile, 1.0):.2f} "
+            parts.append(f"\n最后打出的牌 '{tile}' 的权重: {self.ai.tile_weights.get(tile, 1.0):.2f}\n")
+            parts.append("相邻牌权重: ")
+            for adjacent_tile in TILE_NEIGHBORS[tile]:
+                parts.append(f"{adjacent_tile}:{self.ai.tile_weights.get(adjacent_tile, 1.0):.2f} ")
         else:
-            weights_text += "\n暂无最后打出的牌信息。\n"
+            parts.append("\n暂无最后打出的牌信息。\n")
 
+        weights_text = "".join(parts)
+        if weights_text == self._last_weights_text:
+            return
+        self._last_weights_text = weights_text
         self.weights_text.delete(1.0, tk.END)
         self.weights_text.insert(tk.END, weights_text)